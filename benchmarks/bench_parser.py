@@ -0,0 +1,81 @@
+"""
+Throughput of GenList.get_file_list on a synthetic .bib file, against the
+configparser-based parser it replaced.
+
+    python benchmarks/bench_parser.py [--entries 100000]
+"""
+from os import path
+import sys, time, argparse, tempfile, tracemalloc, configparser
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from sci_clone import util
+
+
+def legacy_file_list(file_path):
+    # GenList.get_file_list as of sci-clone 0.4.2
+    with open(file_path, 'r') as f:
+        file_content = f.read()
+    items = file_content.lower().strip().split('@')[1:]
+    for item in items:
+        bibtex = configparser.ConfigParser(allow_no_value=True)
+        bibtex.read_string('[item]' + item.rstrip('}\n'))
+        bibtex['item']['cate'] = item.split(',')[0].split('{')[0]
+        bibtex['item']['citekey'] = item.split(',')[0].split('{')[1]
+        for key in bibtex['item']:
+            bibtex['item'][key] = bibtex['item'][key].lstrip('{"').rstrip(',')
+            if bibtex['item'][key].endswith('}') or bibtex['item'][key].endswith('"'):
+                bibtex['item'][key] = bibtex['item'][key][:-1]
+            bibtex['item'][key] = bibtex['item'][key].replace('\n', ' ')
+        item_dict = dict(bibtex.items('item'))
+        if 'doi' in item_dict:
+            yield item_dict['doi']
+        elif 'url' in item_dict:
+            yield item_dict['url']
+        elif 'pmid' in item_dict:
+            yield item_dict['pmid']
+
+
+def write_bib(file_path, entries):
+    # entries the legacy parser can read too: no '@' inside values
+    with open(file_path, 'w') as f:
+        for i in range(entries):
+            f.write(f"@article{{key{i},\n"
+                    f"\ttitle = {{A {{Nested}} Title Number {i} about Sociology of Education}},\n"
+                    f"\tauthor = {{Doe, Jane and Roe, Richard and Poe, Edgar}},\n"
+                    f"\tjournal = {{Journal of Benchmarks}},\n"
+                    f"\tvolume = {{{i % 100}}},\n"
+                    f"\tpages = {{1--20}},\n"
+                    f"\tdoi = {{10.1000/bench.{i}}},\n"
+                    f"\turl = {{https://example.org/article/{i}}},\n"
+                    f"\tabstract = {{{'Lorem ipsum dolor sit amet. ' * 20}}},\n"
+                    f"}}\n\n")
+
+
+def measure(name, func, file_path):
+    started = time.perf_counter()
+    count = sum(1 for _ in func(file_path))
+    elapsed = time.perf_counter() - started
+    # a second pass for memory, tracemalloc slows the parsers down
+    tracemalloc.start()
+    sum(1 for _ in func(file_path))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:>8}: {count} ids in {elapsed:.2f}s, {count / elapsed:,.0f} entries/s, "
+          f"peak memory {peak / 2 ** 20:.1f} MiB")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = path.join(tmp, "bench.bib")
+        write_bib(file_path, args.entries)
+        print(f"{args.entries} entries, {path.getsize(file_path) / 2 ** 20:.1f} MiB")
+        generator = util.GenList([file_path], None)
+        assert measure("legacy", legacy_file_list, file_path) == measure("current", generator.get_file_list, file_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Offline throughput benchmarks for Processing.walk_the_list,
+GenList.get_journal_works and GenList.get_file_list, run against the local
+stand-ins in servers.py.
+
+    python benchmarks/run.py [--items 500] [--jobs 8] [--latency 0.02] ...
+    python benchmarks/run.py --save baseline.json
+    python benchmarks/run.py --baseline baseline.json --tolerance 0.2
+
+Each benchmark runs in its own process so that its peak RSS is its own.
+walk_the_list counts only the items downloaded towards items/sec, and
+reports how many were done, missing and failed. With --baseline, the run
+fails (exit code 1) when a benchmark's items/sec drops, or its p99 latency
+grows, by more than the tolerance, or when fewer items are done.
+"""
+from os import path
+from multiprocessing import get_context
+import sys, io, json, time, argparse, tempfile, contextlib
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from sci_clone import util, config
+from servers import SciHubStandIn, CrossrefStandIn
+from bench_parser import write_bib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def report(name, items, elapsed, latencies, bytes_transferred, outcomes=None):
+    return {"benchmark": name, "items": items, "seconds": round(elapsed, 3), **(outcomes or dict()),
+            "items_per_sec": round(items / elapsed, 1) if elapsed else None,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+            "peak_rss_mb": round(peak_rss() / 2 ** 20, 1) if peak_rss() else None,
+            "bytes": bytes_transferred}
+
+
+def timed(latencies, func):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    return wrapper
+
+
+def bench_walk_the_list(args):
+    scihub = SciHubStandIn(latency=args.latency, error_rate=args.error_rate, payload_size=args.payload_size,
+                           missing_rate=args.missing_rate).start()
+    requester = util.Requester(config, per_host=args.per_host)
+    query = util.as_query("bench", {"bench": [f"10.5555/bench.{i}" for i in range(args.items)]})
+    latencies = list()
+    with tempfile.TemporaryDirectory() as tmp:
+        processing = util.Processing(scihub.url, requester, query, tmp, jobs=args.jobs)
+        processing.get_pdf_scihub = timed(latencies, processing.get_pdf_scihub)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            processing.download()
+        elapsed = time.perf_counter() - started
+    scihub.stop()
+    counts = requester.metrics.phases.get("item", dict()).get("items", dict())
+    outcomes = {outcome: counts.get(outcome, 0) for outcome in ("done", "missing", "failed")}
+    return report("walk_the_list", outcomes["done"], elapsed, latencies, scihub.bytes_sent, outcomes)
+
+
+def bench_get_journal_works(args):
+    crossref = CrossrefStandIn(works=args.works, years=(2000, 2020), latency=args.latency,
+                               error_rate=args.error_rate, payload_size=args.work_size).start()
+    requester = util.Requester(config, per_host=args.per_host)
+    generator = util.GenList(["0000-0000", "2000", "2020"], requester, crossref=crossref.url)
+    latencies = list()
+    generator.get_works_page = timed(latencies, generator.get_works_page)
+    started = time.perf_counter()
+    title, keys, total, works = generator.get_query_list()
+    items = sum(1 for _ in works)
+    elapsed = time.perf_counter() - started
+    crossref.stop()
+    return report("get_journal_works", items, elapsed, latencies, crossref.bytes_sent)
+
+
+def bench_get_file_list(args):
+    latencies = list()
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = path.join(tmp, "bench.bib")
+        write_bib(file_path, args.entries)
+        generator = util.GenList([file_path], None)
+        started = last = time.perf_counter()
+        items = 0
+        for _ in generator.get_file_list(file_path):
+            now = time.perf_counter()
+            latencies.append(now - last)
+            last, items = now, items + 1
+        elapsed = time.perf_counter() - started
+        size = path.getsize(file_path)
+    return report("get_file_list", items, elapsed, latencies, size)
+
+
+BENCHMARKS = {"walk_the_list": bench_walk_the_list,
+              "get_journal_works": bench_get_journal_works,
+              "get_file_list": bench_get_file_list}
+
+
+def run_isolated(name, args):
+    with get_context("spawn").Pool(1) as pool:
+        return pool.apply(BENCHMARKS[name], (args,))
+
+
+def regressions(results, baseline, tolerance):
+    failures = list()
+    previous = {result["benchmark"]: result for result in baseline}
+    for result in results:
+        before = previous.get(result["benchmark"])
+        if not before:
+            continue
+        if before["items_per_sec"] and result["items_per_sec"] < before["items_per_sec"] * (1 - tolerance):
+            failures.append(f"{result['benchmark']}: items/sec {before['items_per_sec']} -> {result['items_per_sec']}")
+        if before["p99_ms"] and result["p99_ms"] and result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            failures.append(f"{result['benchmark']}: p99 {before['p99_ms']}ms -> {result['p99_ms']}ms")
+        if "done" in before and result.get("done", 0) < before["done"]:
+            failures.append(f"{result['benchmark']}: done {before['done']} -> {result.get('done', 0)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", help=f"any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--items", type=int, default=500, help="items for walk_the_list")
+    parser.add_argument("--works", type=int, default=20000, help="works for get_journal_works")
+    parser.add_argument("--entries", type=int, default=20000, help="entries for get_file_list")
+    parser.add_argument("--jobs", type=int, default=config.__jobs__)
+    parser.add_argument("--per-host", type=int, default=config.__per_host__)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per stand-in response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 503 responses")
+    parser.add_argument("--missing-rate", type=float, default=0.05, help="share of items Sci-Hub lacks")
+    parser.add_argument("--payload-size", type=int, default=256 * 1024, help="bytes per PDF")
+    parser.add_argument("--work-size", type=int, default=1024, help="bytes of padding per Crossref work")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, as a share")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+
+    results = list()
+    for name in args.benchmarks or BENCHMARKS:
+        result = run_isolated(name, args)
+        results.append(result)
+        outcomes = f" ({result['missing']} missing, {result['failed']} failed)" if "done" in result else ""
+        print(f"{result['benchmark']:>18}: {result['items']} items{outcomes} in {result['seconds']}s, "
+              f"{result['items_per_sec']} items/s, p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms, "
+              f"peak RSS {result['peak_rss_mb']} MiB, {result['bytes'] / 2 ** 20:.1f} MiB transferred")
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            failures = regressions(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Local stand-ins for the hosts sci-clone talks to, so that its throughput
+can be measured offline.
+
+- SciHubStandIn answers the resolve POST with the page get_pdf_scihub
+  parses, and serves the PDF it links to (with Range support).
+- CrossrefStandIn serves /journals/{issn}/works with cursor pagination.
+
+Both take a latency (seconds per response), an error rate (share of 503
+responses) and a payload size, and count the bytes they send.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import json, random, re, threading, time
+
+
+class StandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, latency=0.0, error_rate=0.0, payload_size=0, seed=0):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.payload_size = payload_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.bytes_sent = 0
+        self.requests = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def fail(self):
+        with self.lock:
+            self.requests += 1
+            return self.random.random() < self.error_rate
+
+    def sent(self, size):
+        with self.lock:
+            self.bytes_sent += size
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        for key, value in (headers or dict()).items():
+            self.send_header(key, value)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.sent(len(body))
+
+    def begin(self):
+        time.sleep(self.server.latency)
+        if self.server.fail():
+            self.reply(503, b"Service Unavailable")
+            return False
+        return True
+
+
+class SciHubHandler(Handler):
+    def do_POST(self):
+        length = int(self.headers.get("content-length", 0))
+        query = parse_qs(self.rfile.read(length).decode()).get("request", [""])[0]
+        if not self.begin():
+            return
+        if not query or self.server.missing(query):
+            body = b"<p>Sorry, sci-hub has not included this article yet</p>"
+        else:
+            name = re.sub("[^0-9a-zA-Z.]", "_", query)
+            body = (f"<div id=\"buttons\"><button onclick=\"location.href='{self.server.url}"
+                    f"/downloads/{name}.pdf?download=true'\">&#8659; save</button></div>").encode()
+        self.reply(200, body, {"content-type": "text/html"})
+
+    def do_GET(self):
+        if not self.begin():
+            return
+        body = self.server.pdf
+        match = re.match("bytes=([0-9]+)-", self.headers.get("range", ""))
+        if match and int(match.group(1)) < len(body):
+            start = int(match.group(1))
+            self.reply(206, body[start:], {"content-range": f"bytes {start}-{len(body) - 1}/{len(body)}",
+                                           "content-type": "application/pdf"})
+        else:
+            self.reply(200, body, {"content-type": "application/pdf"})
+
+
+class CrossrefHandler(Handler):
+    def do_GET(self):
+        if not self.begin():
+            return
+        parts = urlsplit(self.path)
+        params = {key: value[0] for key, value in parse_qs(parts.query).items()}
+        if not re.match("^/journals/[^/]+/works$", parts.path):
+            self.reply(404, b"Not Found")
+            return
+        years = [int(year) for year in re.findall("(?:from|until)-pub-date:([0-9]{4})", params.get("filter", ""))]
+        works = [work for work in self.server.works if not years or years[0] <= work[1] <= years[-1]]
+        rows = int(params.get("rows", 20))
+        start = 0 if params.get("cursor", "*") == "*" else int(params["cursor"])
+        items = [self.server.item(doi, year) for doi, year in works[start:start + rows]]
+        if params.get("select"):
+            fields = params["select"].split(",")
+            items = [{key: value for key, value in item.items() if key in fields} for item in items]
+        message = {"total-results": len(works), "next-cursor": str(start + rows), "items-per-page": rows,
+                   "items": items}
+        body = json.dumps({"status": "ok", "message-type": "work-list", "message": message}).encode()
+        self.reply(200, body, {"content-type": "application/json"})
+
+
+class SciHubStandIn(StandIn):
+    def __init__(self, latency=0.0, error_rate=0.0, payload_size=256 * 1024, missing_rate=0.0, seed=0):
+        super().__init__(SciHubHandler, latency, error_rate, payload_size, seed)
+        self.missing_rate = missing_rate
+        self.seed = seed
+        self.pdf = b"%PDF-1.4\n" + bytes(max(0, payload_size - 9))
+
+    def missing(self, query):
+        """
+        the same items are missing on every run, whatever order they come in
+        """
+        return random.Random(f"{self.seed}:{query}").random() < self.missing_rate
+
+
+class CrossrefStandIn(StandIn):
+    def __init__(self, works=2000, years=(2000, 2020), latency=0.0, error_rate=0.0, payload_size=0, seed=0):
+        """
+        payload_size pads every work with an abstract of that many bytes, the
+        way full records (without select) weigh on a real response
+        """
+        super().__init__(CrossrefHandler, latency, error_rate, payload_size, seed)
+        self.works = [(f"10.5555/bench.{i}", years[0] + i % (years[1] - years[0] + 1)) for i in range(works)]
+
+    def item(self, doi, year):
+        item = {"DOI": doi, "URL": f"https://doi.org/{doi}", "published": {"date-parts": [[year, 1, 1]]},
+                "container-title": ["Journal of Benchmarks"]}
+        if self.payload_size:
+            item["abstract"] = "x" * self.payload_size
+        return item
@@ -15,3 +15,20 @@ __description__ = "A simple tool for cloning from Sci-Hub."
 __author__ = "f10w3r"
 __author_email__ = "lifuminster@gmail.com"
 __scihub__ = "sci-hub.wf"
+__crossref__ = "http://api.crossref.org"
+
+__jobs__ = 4
+__per_host__ = 4
+__connect_timeout__ = 10
+__read_timeout__ = 30
+__retries__ = 4
+__chunk_size__ = 64 * 1024
+__manifest__ = ".sci-clone.db"
+__missing_ttl__ = 24
+__rows__ = 1000
+__cache_ttl__ = 24
+__cache_size__ = 256
+__events__ = "sci-clone.events.jsonl"
+__report__ = "sci-clone.report.json"
+__profile__ = "sci-clone.prof"
+__min_size__ = 1024
\ No newline at end of file
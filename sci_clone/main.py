@@ -2,7 +2,8 @@ from . import util, config
 import typer
 from typing import List, Tuple, Optional
 from pathlib import Path
-from os import path, getcwd, mkdir
+from os import path, getcwd, mkdir, makedirs, environ
+import platform, cProfile, pstats, shlex, re
 
 
 app = typer.Typer()
@@ -17,11 +18,36 @@ def version_callback(value: bool):
 
 @app.command(help="For detailed usage, please view: https://github.com/f10w3r/sci-clone")
 def main(
-    query_str: List[str] = typer.Argument(..., metavar="Query String", 
+    query_str: Optional[List[str]] = typer.Argument(None, metavar="Query String", 
                                           help="by DOI/URL or by ISSN", show_default=False, hidden=True),
     url_scihub: str = typer.Option(config.__scihub__, '--scihub', '-s'),
     save_to: Path = typer.Option(getcwd, '--dir', '-d', 
                                  help="Directory to download", show_default="Current directory"),
+    jobs: int = typer.Option(config.__jobs__, '--jobs', '-j', min=1,
+                             help="Number of concurrent downloads"),
+    per_host: int = typer.Option(config.__per_host__, '--per-host', min=1,
+                                 help="Maximum concurrent connections per host"),
+    connect_timeout: float = typer.Option(config.__connect_timeout__, '--connect-timeout',
+                                          help="Seconds to wait for a connection"),
+    read_timeout: float = typer.Option(config.__read_timeout__, '--read-timeout',
+                                       help="Seconds to wait for data on a connection"),
+    manifest_path: Optional[Path] = typer.Option(None, '--manifest', '-m',
+                                                 help="Manifest of resolved and downloaded items",
+                                                 show_default=f"{config.__manifest__} in download directory"),
+    missing_ttl: float = typer.Option(config.__missing_ttl__, '--missing-ttl',
+                                      help="Hours before an item known to be missing is tried again"),
+    retry_missing: bool = typer.Option(False, '--retry-missing',
+                                       help="Retry every item the manifest has not downloaded yet"),
+    incremental: bool = typer.Option(False, '--incremental', '-i',
+                                     help="Only query works indexed by Crossref since the last sync"),
+    cache_ttl: float = typer.Option(config.__cache_ttl__, '--cache-ttl',
+                                    help="Hours to keep Crossref responses cached, 0 to disable"),
+    store_path: Optional[Path] = typer.Option(None, '--store',
+                                              help="Content-addressed store to deduplicate files across runs"),
+    batch: Optional[Path] = typer.Option(None, '--batch', '-b', exists=True, dir_okay=False,
+                                         help="File of jobs, one query per line, optionally with -d DIR"),
+    profile: bool = typer.Option(False, '--profile',
+                                 help=f"Dump cProfile stats of the download to {config.__profile__}"),
     version: Optional[bool] = typer.Option(None, "--version", "-v", 
                                            help="Show version", callback=version_callback)
 ):  
@@ -33,11 +59,101 @@ def main(
         typer.secho('Error: Invalid path.', fg=typer.colors.MAGENTA)
         raise typer.Exit(code=1)
     
-    requester = util.Requester(config, timeout=30)
-    generator = util.GenList(query_str, requester)
-    query = generator.get_query_list()
-    processing = util.Processing(url_scihub, requester, query, save_to)
-    processing.download()
+    if not query_str and not retry_missing and not batch:
+        typer.secho('Error: Missing query string.', fg=typer.colors.MAGENTA)
+        raise typer.Exit(code=1)
+    
+    metrics = util.Metrics(path.join(save_to, config.__events__))
+    requester = util.Requester(config, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                               per_host=per_host, metrics=metrics)
+    manifest = util.Manifest(manifest_path or path.join(save_to, config.__manifest__))
+    store = util.Store(store_path) if store_path else None
+    profiler = cProfile.Profile() if profile else None
+    try:
+        if profiler: profiler.enable()
+        cache = util.PageCache(path.join(user_cache_dir(), "crossref"), cache_ttl) if cache_ttl > 0 else None
+        if retry_missing:
+            batch_jobs = [(None, util.as_query("missing", manifest.missing()), save_to)]
+            missing_ttl = 0
+        else:
+            batch_jobs = list()
+            for job_query, job_dir in (read_batch(batch, save_to) if batch else [(query_str, save_to)]):
+                if not path.exists(job_dir): makedirs(job_dir)
+                generator = util.GenList(job_query, requester, manifest=manifest, cache=cache, incremental=incremental)
+                try:
+                    batch_jobs.append((generator, generator.get_query_list(), job_dir))
+                except typer.Exit:
+                    if batch: typer.secho(f'in batch job: {shlex.join(job_query)}', fg=typer.colors.MAGENTA)
+                    raise
+                except Exception as error:
+                    # one journal failing to list must not hold up the rest of the batch
+                    if not batch: raise
+                    typer.secho(f'skipping batch job: {shlex.join(job_query)}: {error}', fg=typer.colors.MAGENTA)
+        # every job shares the requester, hence the per-host limits, and one pool of workers
+        processings = [util.Processing(url_scihub, requester, query, job_dir, jobs=jobs, manifest=manifest,
+                                       missing_ttl=missing_ttl, profile=profile, root=save_to, store=store)
+                       for generator, query, job_dir in batch_jobs]
+        tasks = [(processing, *processing.prepare()) for processing in processings]
+        label = tasks[0][1] if len(tasks) == 1 else f"batch of {len(tasks)} jobs: {sum(task[3] for task in tasks)}"
+        util.Scheduler(jobs).run(tasks, label)
+        for (generator, query, job_dir), processing in zip(batch_jobs, processings):
+            if generator: generator.save_sync(processing.unsettled)
+        if profiler:
+            profiler.disable()
+            stats = pstats.Stats(profiler, *[p for processing in processings for p in processing.profiles])
+            stats.dump_stats(path.join(save_to, config.__profile__))
+            stats.sort_stats("cumulative").print_stats(20)
+            typer.secho(f'profile: {path.join(save_to, config.__profile__)}', fg=typer.colors.BLUE)
+    finally:
+        manifest.close()
+        if store: store.close()
+        summary = metrics.write_report(path.join(save_to, config.__report__))
+        items = summary["phases"].get("item", dict())
+        typer.secho(f'{", ".join(f"{k}: {v}" for k, v in items.get("items", dict()).items()) or "no items"} '
+                    f'in {summary["seconds"]}s, report: {path.join(save_to, config.__report__)}',
+                    fg=typer.colors.BLUE)
+
+def read_batch(batch_file, save_to):
+    """
+    one job per line: the query as given on the command line, optionally followed
+    by -d/--dir with the job's directory relative to the download directory;
+    a default directory already taken by an earlier job gets the line number
+    """
+    used = set()
+    with open(batch_file, 'r') as f:
+        for number, line in enumerate(f, 1):
+            args = shlex.split(line, comments=True)
+            job_dir = None
+            for flag in ('-d', '--dir'):
+                if flag in args:
+                    at = args.index(flag)
+                    job_dir = args[at + 1] if at + 1 < len(args) else None
+                    del args[at:at + 2]
+            if not args:
+                continue
+            if job_dir:
+                if path.normpath(job_dir) in used:
+                    typer.secho(f'Error: line {number} of {batch_file}: directory "{job_dir}" '
+                                f'is used by another job.', fg=typer.colors.MAGENTA)
+                    raise typer.Exit(code=1)
+            else:
+                if re.match("^[0-9]{4}-[0-9]{3}[0-9xX]$", args[0]):
+                    job_dir = args[0]
+                elif args[0].endswith('.txt') or args[0].endswith('.bib'):
+                    job_dir = Path(args[0]).stem
+                else:
+                    job_dir = "paper list"
+                if path.normpath(job_dir) in used:
+                    job_dir = f"{job_dir} (line {number})"
+            used.add(path.normpath(job_dir))
+            yield args, path.join(save_to, job_dir)
+
+def user_cache_dir():
+    if platform.system() == "Windows":
+        return path.join(environ.get("LOCALAPPDATA", path.expanduser("~")), config.__name__, "Cache")
+    elif platform.system() == "Darwin":
+        return path.join(path.expanduser("~/Library/Caches"), config.__name__)
+    return path.join(environ.get("XDG_CACHE_HOME", path.expanduser("~/.cache")), config.__name__)
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
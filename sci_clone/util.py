@@ -1,27 +1,204 @@
 from . import config
 import typer
-from os import path, mkdir
-from datetime import datetime
+from os import path, mkdir, makedirs, remove, replace, scandir, utime, getpid, link as hardlink
+from shutil import move, copyfile
+from datetime import datetime, timezone
 from urllib import request, parse
-import time, re, json, configparser
+from http.client import HTTPConnection, HTTPSConnection, HTTPException, RemoteDisconnected
+from email.utils import parsedate_to_datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+import sys, time, re, json, threading, random, socket, sqlite3, hashlib, base64, cProfile
+
+
+class HTTPError(Exception):
+    def __init__(self, url, status, reason, headers):
+        super().__init__(f"HTTP {status} {reason}: {url}")
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+
+class HostLimiter:
+    """
+    cap the number of concurrent connections per host
+    """
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self.lock = threading.Lock()
+        self.semaphores = dict()
+
+    def semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self.semaphores[host]
+
+    def acquire(self, host):
+        self.semaphore(host).acquire()
+
+    def release(self, host):
+        self.semaphore(host).release()
+
+
+class Response:
+    """
+    a response bound to a pooled connection, which is handed back to the
+    session once the body is fully read or the response is closed
+    """
+    def __init__(self, session, key, conn, response, url):
+        self.session = session
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.bytes = 0
+        self.on_close = None
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        self.bytes += len(data)
+        if self.response.isclosed():
+            self.close()
+        return data
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.response.isclosed():
+            self.session.release(self.key, self.conn)
+        else:
+            self.conn.close()
+            self.session.release(self.key, None)
+        self.conn = None
+        if self.on_close:
+            self.on_close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Session:
+    """
+    keep-alive connections pooled per host, safe to share between threads
+    """
+    def __init__(self, connect_timeout, read_timeout, per_host):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.limiter = HostLimiter(per_host)
+        self.lock = threading.Lock()
+        self.idle = dict()
+
+    def acquire(self, key):
+        self.limiter.acquire(key[1])
+        with self.lock:
+            if self.idle.get(key):
+                return self.idle[key].pop()
+        scheme, netloc = key
+        proxy = request.getproxies().get(scheme)
+        if proxy and not request.proxy_bypass(netloc):
+            proxy = parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            conn_class = HTTPSConnection if proxy.scheme == "https" else HTTPConnection
+            conn = conn_class(proxy.hostname, proxy.port, timeout=self.connect_timeout)
+            auth = dict()
+            if proxy.username:
+                credentials = f"{parse.unquote(proxy.username)}:{parse.unquote(proxy.password or '')}"
+                auth["proxy-authorization"] = f"Basic {base64.b64encode(credentials.encode()).decode()}"
+            if scheme == "https":
+                conn.set_tunnel(netloc if ":" in netloc else f"{netloc}:443", headers=auth)
+            else:
+                # plain http goes through the proxy as an absolute URL, many
+                # proxies refuse to CONNECT to anything but port 443
+                conn.forward = True
+                conn.proxy_headers = auth
+        else:
+            conn_class = HTTPSConnection if scheme == "https" else HTTPConnection
+            conn = conn_class(netloc, timeout=self.connect_timeout)
+        return conn
+
+    def release(self, key, conn):
+        if conn is not None:
+            with self.lock:
+                self.idle.setdefault(key, list()).append(conn)
+        self.limiter.release(key[1])
+
+    def open(self, method, url, body, headers):
+        parts = parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        while True:
+            conn = self.acquire(key)
+            reused = conn.sock is not None
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    conn.sock.settimeout(self.read_timeout)
+                if getattr(conn, "forward", False):
+                    conn.request(method, f"{parts.scheme}://{parts.netloc}{target}", body,
+                                 {**headers, **conn.proxy_headers})
+                else:
+                    conn.request(method, target, body, headers)
+                return Response(self, key, conn, conn.getresponse(), url)
+            except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # the server dropped an idle keep-alive connection, try a fresh one
+                conn.close()
+                self.release(key, None)
+                if not reused:
+                    raise
+            except BaseException:
+                conn.close()
+                self.release(key, None)
+                raise
+
+    def send(self, method, url, body=None, headers=None, max_redirects=5):
+        headers = headers or dict()
+        for _ in range(max_redirects + 1):
+            response = self.open(method, url, body, headers)
+            if response.status in (301, 302, 303, 307, 308) and response.headers.get("location"):
+                # the connection goes back to the pool, or is dropped, even if the read fails
+                with response:
+                    response.read()
+                url = parse.urljoin(url, response.headers["location"])
+                if response.status in (301, 302, 303) and method == "POST":
+                    method, body = "GET", None
+                    headers = {k: v for k, v in headers.items() if k.lower() != "content-type"}
+                continue
+            if response.status >= 400:
+                with response:
+                    response.read()
+                raise HTTPError(url, response.status, response.reason, response.headers)
+            return response
+        raise HTTPError(url, response.status, "Too many redirects", response.headers)
 
 
 class Requester:
-    def __init__(self, config, timeout):
+    def __init__(self, config, connect_timeout=config.__connect_timeout__, read_timeout=config.__read_timeout__,
+                 per_host=config.__per_host__, metrics=None):
         etiquette = f"{config.__name__ }/{config.__version__} ({config.__url__}; " + \
                 f"mailto:{config.__author_email__}) " + \
                 f"BasedOn:{config.__name__}/{config.__version__}"
         self.header = {"user-agent": etiquette}
-        self.timeout = timeout
+        self.session = Session(connect_timeout, read_timeout, per_host)
+        self.metrics = metrics or Metrics()
     
     # retry decorator
     # Example:
-    # @retry(3, 2) or @retry()
+    # @retry(3, 1, 30)
     # def test():
     #     pass
-    def retry(retry_count, retry_interval):
+    def retry(retry_count, backoff, max_backoff):
         """
-        retry decorator
+        retry decorator, with exponential backoff and full jitter;
+        4xx responses other than 408/425/429 are not retried,
+        and Retry-After is honored when the server sends it
         """
         def real_decorator(decor_method):
             def wrapper(*args, **kwargs):
@@ -29,33 +206,286 @@ class Requester:
                     try:
                         return_values = decor_method(*args, **kwargs)
                         return return_values
-                    except Exception as error:
-                        print(f"\nFATAL: retry: {count + 1}. Function execution failed for {decor_method.__name__}")
-                        time.sleep(retry_interval)
+                    except HTTPError as error:
+                        if error.status < 500 and error.status not in (408, 425, 429) or count == retry_count-1:
+                            raise error
+                        # the name bound by "except ... as" is gone after the block
+                        last = error
+                        delay = retry_after(error.headers.get("retry-after"))
+                        if delay is None:
+                            delay = random.uniform(0, min(max_backoff, backoff * 2 ** count))
+                    except (OSError, HTTPException) as error:
                         if count == retry_count-1:
                             raise error
+                        last = error
+                        delay = random.uniform(0, min(max_backoff, backoff * 2 ** count))
+                    args[0].metrics.record("retry", kwargs.get("phase", "http"), attempt=count + 1,
+                                           error=str(last), delay=round(delay, 3))
+                    typer.secho(f"\nretry {count + 1} of {decor_method.__name__} in {delay:.1f}s: {last}",
+                                fg=typer.colors.YELLOW, err=True)
+                    time.sleep(delay)
             return wrapper
         return real_decorator
     
-    @retry(retry_count=3, retry_interval=2)
-    def request(self, url, params="", method="GET"):
+    @retry(retry_count=config.__retries__, backoff=1, max_backoff=30)
+    def request(self, url, params="", method="GET", headers=None, phase="http"):
         query_string = parse.urlencode(params)
+        headers = {**self.header, **(headers or dict())}
+        body = None
         if method == "GET":
             if params:
-                req = request.Request(f"{url}?{query_string}")
-            else:
-                req = request.Request(url)
+                url = f"{url}?{query_string}"
         elif method == "POST":
-            req = request.Request(url, query_string.encode("UTF-8"))
-        for key in self.header.keys():
-            req.add_header(key, self.header[key])
-        response = request.urlopen(req, timeout=self.timeout)
+            body = query_string.encode("UTF-8")
+            headers["content-type"] = "application/x-www-form-urlencoded"
+        started = time.perf_counter()
+        try:
+            response = self.session.send(method, url, body, headers)
+        except HTTPError as error:
+            self.metrics.record("request", phase, method=method, url=url, status=error.status,
+                                seconds=round(time.perf_counter() - started, 4), error=str(error))
+            raise error
+        except (OSError, HTTPException) as error:
+            self.metrics.record("request", phase, method=method, url=url,
+                                seconds=round(time.perf_counter() - started, 4), error=repr(error))
+            raise error
+        response.on_close = lambda response: self.metrics.record(
+            "request", phase, method=method, url=url, status=response.status, bytes=response.bytes,
+            seconds=round(time.perf_counter() - started, 4))
         return response
 
+
+def retry_after(value, limit=120):
+    """
+    seconds to wait from a Retry-After header, given in seconds or as an HTTP date
+    """
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return min(limit, int(value))
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return min(limit, max(0, moment.timestamp() - time.time()))
+
+
+class Metrics:
+    """
+    thread-safe record of requests, retries and items: every event is appended
+    to a JSON-lines log when one is given, and folded into per-phase totals
+    """
+    def __init__(self, log_path=None):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.log = open(log_path, 'w') if log_path else None
+        self.phases = dict()
+
+    def record(self, kind, phase, **fields):
+        with self.lock:
+            if self.log:
+                self.log.write(json.dumps({"time": round(time.time(), 3), "kind": kind, "phase": phase, **fields}) + "\n")
+            if phase not in self.phases:
+                self.phases[phase] = {"requests": 0, "retries": 0, "errors": 0, "bytes": 0, "statuses": dict(),
+                                      "items": dict(), "seconds": list()}
+            totals = self.phases[phase]
+            if kind == "retry":
+                totals["retries"] += 1
+                return
+            if kind == "request":
+                totals["requests"] += 1
+                totals["bytes"] += fields.get("bytes", 0)
+                if "status" in fields:
+                    totals["statuses"][str(fields["status"])] = totals["statuses"].get(str(fields["status"]), 0) + 1
+                if "error" in fields:
+                    totals["errors"] += 1
+            elif kind == "item":
+                totals["items"][fields["outcome"]] = totals["items"].get(fields["outcome"], 0) + 1
+            totals["seconds"].append(fields.get("seconds", 0))
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        summary = {"started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                   "seconds": round(elapsed, 3), "phases": dict()}
+        with self.lock:
+            for phase, totals in self.phases.items():
+                seconds = sorted(totals["seconds"])
+                count = totals["requests"] or sum(totals["items"].values())
+                summary["phases"][phase] = {
+                    **{key: value for key, value in totals.items() if key != "seconds" and value},
+                    "seconds": round(sum(seconds), 3),
+                    "p50_ms": round(seconds[len(seconds) // 2] * 1000, 1) if seconds else None,
+                    "p99_ms": round(seconds[min(len(seconds) - 1, int(len(seconds) * 0.99))] * 1000, 1) if seconds else None,
+                    "per_sec": round(count / elapsed, 2) if elapsed else None,
+                    "bytes_per_sec": round(totals["bytes"] / elapsed) if elapsed else None}
+        return summary
+
+    def write_report(self, report_path):
+        summary = self.summary()
+        with open(report_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        with self.lock:
+            if self.log:
+                self.log.close()
+                self.log = None
+        return summary
+
+
+def normalize(query):
+    """
+    canonical form of a DOI/URL/PMID, used as the manifest key
+    """
+    query = query.strip()
+    doi = re.match("^(?:https?://(?:dx\\.)?doi\\.org/|doi:)?(10\\.[0-9]{4,}/.+)$", query, re.IGNORECASE)
+    if doi:
+        return doi.group(1).lower()
+    if re.match("^https?://", query, re.IGNORECASE):
+        parts = parse.urlsplit(query)
+        return parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"),
+                                 parts.query, ""))
+    return query.lower()
+
+
+class Manifest:
+    """
+    on-disk record of resolved and downloaded items, keyed by normalized DOI/URL/PMID
+    """
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS items (
+            key TEXT PRIMARY KEY, query TEXT, sub_dir TEXT, file_url TEXT, file_name TEXT,
+            size INTEGER, status TEXT, attempts INTEGER DEFAULT 0, updated REAL)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS syncs (
+            issn TEXT, year INTEGER, synced TEXT, PRIMARY KEY (issn, year))""")
+        self.db.commit()
+
+    def get(self, query):
+        with self.lock:
+            return self.db.execute("SELECT * FROM items WHERE key = ?", (normalize(query),)).fetchone()
+
+    def record(self, query, sub_dir, status, file_url=None, file_name=None, size=None):
+        with self.lock:
+            self.db.execute("""INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT(key) DO UPDATE SET query = excluded.query, sub_dir = excluded.sub_dir,
+                file_url = coalesce(excluded.file_url, file_url), file_name = coalesce(excluded.file_name, file_name),
+                size = coalesce(excluded.size, size), status = excluded.status, attempts = attempts + 1,
+                updated = excluded.updated""",
+                (normalize(query), query, sub_dir, file_url, file_name, size, status, time.time()))
+            self.db.commit()
+
+    def missing(self):
+        """
+        items not downloaded yet, grouped by their directory
+        """
+        list_dict = dict()
+        with self.lock:
+            rows = self.db.execute("SELECT query, sub_dir FROM items WHERE status != 'done' ORDER BY rowid")
+            for row in rows:
+                list_dict.setdefault(row["sub_dir"], list()).append(row["query"])
+        return list_dict
+
+    def last_sync(self, issn, year):
+        with self.lock:
+            row = self.db.execute("SELECT synced FROM syncs WHERE issn = ? AND year = ?", (issn, year)).fetchone()
+        return row["synced"] if row else None
+
+    def set_synced(self, issn, year, synced):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)", (issn, year, synced))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class PageCache:
+    """
+    Crossref pages kept on disk for ttl hours; the least recently used ones
+    are evicted once the cache grows past max_size megabytes
+    """
+    def __init__(self, cache_dir, ttl, max_size=config.__cache_size__):
+        makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.ttl = ttl * 3600
+        self.max_size = max_size * 1024 * 1024
+        self.lock = threading.Lock()
+        self.size = 0
+        self.evict()
+
+    def file_path(self, *key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return path.join(self.cache_dir, f"{digest}.json")
+
+    def get(self, *key):
+        file_path = self.file_path(*key)
+        try:
+            modified = path.getmtime(file_path)
+            if time.time() - modified > self.ttl:
+                return None
+            with open(file_path, 'r') as f:
+                data = json.load(f)
+            # the access time orders eviction, the modification time expiry
+            utime(file_path, (time.time(), modified))
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def put(self, data, *key):
+        file_path = self.file_path(*key)
+        # the cache directory is shared with other sci-clone processes
+        temp_path = f"{file_path}.{getpid()}.{threading.get_ident()}"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+            size = f.tell()
+        replace(temp_path, file_path)
+        with self.lock:
+            self.size += size
+            oversize = self.size > self.max_size
+        if oversize:
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = list()
+            # other processes may replace or evict the same files meanwhile,
+            # and their temporary files are theirs to rename
+            for entry in scandir(self.cache_dir):
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                    if time.time() - stat.st_mtime > self.ttl:
+                        remove(entry.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+            self.size = sum(size for atime, size, file_path in entries)
+            for atime, size, file_path in sorted(entries):
+                if self.size <= self.max_size * 0.9:
+                    break
+                try:
+                    remove(file_path)
+                except FileNotFoundError:
+                    pass
+                self.size -= size
+
+
 class GenList:
-    def __init__(self, query, requester):
+    def __init__(self, query, requester, manifest=None, cache=None, incremental=False,
+                 crossref=config.__crossref__):
         self.query = query
         self.requester = requester
+        self.crossref = crossref
+        self.manifest = manifest
+        self.cache = cache
+        self.incremental = incremental
+        self.synced = dict()
         
     def get_query_list(self):
         if re.match("^[0-9]{4}-[0-9]{3}[0-9xX]$", self.query[0]):
@@ -69,114 +499,451 @@ class GenList:
                 typer.secho('Please follow format: "sci-clone ISSN FROM_YEAR [TO_YEAR]"',
                             fg=typer.colors.MAGENTA)
                 raise typer.Exit(code=1)
-            container_title, list_dict = self.get_journal_works(issn, year0, year1)
+            container_title, total, works = self.get_journal_works(issn, year0, year1)
+            return container_title, range(year0, year1+1), total, works
         else:
-            query_list = []
+            # identifiers are deduplicated across all arguments and files
+            query_list, seen = list(), set()
             for line in self.query:
                 if line.endswith('.txt') or line.endswith('.bib'):
-                    query_list += list(self.get_file_list(line))
+                    queries = self.get_file_list(line)
                 else:
-                    query_list += [line,]
+                    queries = [line.strip(),]
+                for query in queries:
+                    if normalize(query) not in seen:
+                        seen.add(normalize(query))
+                        query_list.append(query)
             container_title = "paper list"
-            list_dict = {container_title: query_list}
-        return container_title, list_dict
+            return as_query(container_title, {container_title: query_list})
     
     def get_file_list(self, file_path):
-        with open(file_path, 'r') as f:
-            file_content = f.read()
-        if file_path.endswith('.txt'):
-            for line in file_content.split('\n'):
-                yield line
-        elif file_path.endswith('.bib'):
-            items = file_content.lower().strip().split('@')[1:]
-            for item in items:
-                bibtex = configparser.ConfigParser(allow_no_value=True)
-                bibtex.read_string('[item]' + item.rstrip('}\n'))
-                bibtex['item']['cate'] = item.split(',')[0].split('{')[0]
-                bibtex['item']['citekey'] = item.split(',')[0].split('{')[1]
-                for key in bibtex['item']:
-                    bibtex['item'][key] = bibtex['item'][key].lstrip('{"').rstrip(',')
-                    if bibtex['item'][key].endswith('}') or bibtex['item'][key].endswith('"'):
-                        bibtex['item'][key] = bibtex['item'][key][:-1]
-                    bibtex['item'][key] = bibtex['item'][key].replace('\n', ' ')
-                item_dict = dict(bibtex.items('item'))
-                if 'doi' in item_dict:
-                    yield item_dict['doi']
-                elif 'url' in item_dict:
-                    yield item_dict['url']
-                elif 'pmid' in item_dict:
-                    yield item_dict['pmid']
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            if file_path.endswith('.txt'):
+                for line in f:
+                    if line.strip():
+                        yield line.strip()
+            elif file_path.endswith('.bib'):
+                for entry_type, fields in iter_bibtex(f):
+                    for key in ('doi', 'url', 'pmid'):
+                        if fields.get(key):
+                            yield fields[key]
+                            break
             
     def get_journal_works(self, issn, year_start, year_end):
-        url = f"http://api.crossref.org/journals/{issn}/works"
-        cursor = '*'
-        results = list()
+        """
+        works are paged year by year as they are consumed, so that overlapping
+        year ranges share cached pages; a single row is fetched right away for
+        the journal title and the total
+        """
+        url = f"{self.crossref}/journals/{issn}/works"
+        since = [self.last_sync(issn, year) for year in range(year_start, year_end+1)]
+        params = {"rows": 1, "select": "container-title",
+                  "filter": self.works_filter(year_start, year_end, None if None in since else min(since))}
+        message = next(self.iter_pages(url, params))
+        titles = [i['container-title'][0] for i in message['items'] if i.get('container-title')]
+        container_title = titles[0] if titles else issn
+        return container_title, message['total-results'], self.iter_works(issn, url, year_start, year_end)
+
+    def iter_works(self, issn, url, year_start, year_end):
+        for year in range(year_start, year_end+1):
+            # from-index-date has a granularity of days, so the overlap of a day is
+            # left to the manifest, which skips the works already downloaded
+            started = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+            params = {"rows": config.__rows__, "select": "DOI,URL,published,container-title",
+                      "filter": self.works_filter(year, year, self.last_sync(issn, year))}
+            for message in self.iter_pages(url, params):
+                for r in message['items']:
+                    if r.get('published', {}).get('date-parts', [[None]])[0][0] == year:
+                        if 'DOI' in r:
+                            yield year, r['DOI']
+                        elif 'URL' in r:
+                            yield year, r['URL']
+            self.synced[(issn, year)] = started
+
+    def iter_pages(self, url, params):
+        """
+        pages are cached by position; a cursor read from the cache may have
+        expired on Crossref's side, so a partial hit walks the pages again live
+        """
+        cursor, page, skip = '*', 0, 0
+        cached = self.cache is not None
         while True:
-            from_to = f"from-pub-date:{year_start},until-pub-date:{year_end}"
-            r = self.requester.request(url, params={"rows": 1000, "cursor": cursor, "filter": from_to})
-            r_json = json.loads(r.read())
-            total = r_json['message']['total-results']
-            cursor = r_json['message']['next-cursor']
-            items = r_json['message']['items']
-            results += items
-            if len(results) < total:
+            message = self.cache.get(url, params, page) if cached else None
+            if message is None:
+                if cached and page:
+                    cursor, page, skip = '*', 0, page
+                cached = False
+                message = self.get_works_page(url, params, cursor)
+                if self.cache:
+                    self.cache.put(message, url, params, page)
+            if page >= skip:
+                yield message
+            if len(message['items']) < params['rows'] or not message['items']:
+                break
+            cursor, page = message['next-cursor'], page + 1
+
+    def get_works_page(self, url, params, cursor):
+        with self.requester.request(url, params={**params, "cursor": cursor}, phase="crossref") as r:
+            return json.loads(r.read())['message']
+
+    def works_filter(self, year_start, year_end, since=None):
+        from_to = f"from-pub-date:{year_start},until-pub-date:{year_end}"
+        return f"{from_to},from-index-date:{since}" if since else from_to
+
+    def last_sync(self, issn, year):
+        if self.incremental and self.manifest:
+            return self.manifest.last_sync(issn, year)
+        return None
+
+    def save_sync(self, unsettled=()):
+        """
+        remember the years fully listed, once their works are processed; years
+        in unsettled had items fail, and keep their previous sync to be listed again
+        """
+        if self.manifest:
+            for (issn, year), started in self.synced.items():
+                if year not in unsettled:
+                    self.manifest.set_synced(issn, year, started)
+
+
+BIB_ENTRY = re.compile("@[ \t\r\n]*([a-zA-Z]+)[ \t\r\n]*([{(])")
+BIB_SCAN = re.compile("[{}()]|\n[ \t\r]*(?=@[ \t\r\n]*[a-zA-Z]+[ \t\r\n]*[{(])")
+BIB_FIELD = re.compile("[ \t\r\n]*([^ \t\r\n=,{}\"#]+)[ \t\r\n]*=[ \t\r\n]*")
+BIB_DELIMITER = re.compile("[{}\"]")
+BIB_BARE = re.compile("[^,#}]*")
+
+
+def iter_bibtex(f, chunk_size=config.__chunk_size__):
+    """
+    read BibTeX entries from a file object one chunk at a time, yielding
+    (entry type, fields) with lowercased field names; only the entry being
+    parsed is held in memory. An entry that is still open when the next one
+    starts on a line of its own is skipped with a warning.
+    """
+    buffer, start, eof = "", 0, False
+    # the entry being scanned: where it starts, its type, its closing
+    # delimiter and where its body starts, plus how far it has been scanned
+    entry, scan, depth = None, 0, 0
+    while True:
+        if entry is None:
+            at = buffer.find("@", start)
+            header = BIB_ENTRY.match(buffer, at) if at >= 0 else None
+            if header:
+                entry = (at, header.group(1).lower(), "}" if header.group(2) == "{" else ")", header.end())
+                scan, depth = header.end(), 0
+            elif at >= 0 and (eof or len(buffer) - at > 64):
+                # a stray '@' outside of any entry
+                start = at + 1
                 continue
             else:
-                break
-        container_title = results[0]['container-title'][0]
-        yearly_result = dict()
-        for year in range(year_start, year_end+1):
-            year_list = list()
-            for r in results:
-                if r['published']['date-parts'][0][0] == year:
-                    if 'DOI' in r:
-                        year_list.append(r['DOI'])
-                    elif 'URL' in r:
-                        year_list.append(r['URL'])
-            yearly_result[year] = year_list
-        return container_title, yearly_result
-    
+                start = len(buffer) if at < 0 else at
+        if entry is not None:
+            at, entry_type, close, body = entry
+            # stop at the last newline until the end of the file, so that
+            # a new entry is never split between two chunks
+            limit = len(buffer) if eof else buffer.rfind("\n", scan)
+            end, broken, scan, depth = bibtex_entry_end(buffer, scan, max(scan, limit), depth, close)
+            if end is not None:
+                if broken:
+                    bibtex_warn(buffer[at:end])
+                elif entry_type not in ("comment", "preamble", "string"):
+                    yield entry_type, bibtex_fields(buffer[body:end])
+                entry, start = None, end if broken else end + 1
+                continue
+            if eof:
+                bibtex_warn(buffer[at:])
+        if eof:
+            return
+        # drop what has been parsed, keep the entry being scanned
+        keep = entry[0] if entry else start
+        if entry:
+            entry = (0, entry[1], entry[2], entry[3] - keep)
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer, start, scan = buffer[keep:] + chunk, start - keep, scan - keep
+
+
+def bibtex_entry_end(buffer, scan, limit, depth, close):
+    """
+    scan buffer[scan:limit] for the delimiter closing an entry; returns
+    (end, broken, scan, depth), where end is None when more input is needed
+    and broken is set when another entry starts before this one is closed
+    """
+    for token in BIB_SCAN.finditer(buffer, scan, limit):
+        char = token.group()
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            if depth == 0 and close == "}":
+                return token.start(), False, token.end(), depth
+            depth -= 1
+        elif char == ")":
+            if depth == 0 and close == ")":
+                return token.start(), False, token.end(), depth
+        elif char != "(":
+            return token.end(), True, token.end(), depth
+    return None, False, limit, depth
+
+
+def bibtex_warn(entry):
+    head = " ".join(entry[:60].split())
+    typer.secho(f"skipping malformed BibTeX entry: {head}...", fg=typer.colors.MAGENTA, err=True)
+
+
+def bibtex_fields(body):
+    fields = dict()
+    pos = body.find(",") + 1
+    while 0 < pos < len(body):
+        field = BIB_FIELD.match(body, pos)
+        if not field:
+            pos = body.find(",", pos) + 1
+            continue
+        value, pos = bibtex_value(body, field.end())
+        fields[field.group(1).lower()] = " ".join(value.replace("{", "").replace("}", "").split())
+        pos = body.find(",", pos) + 1
+    return fields
+
+
+def bibtex_value(body, pos):
+    """
+    a braced, quoted or bare value, including '#' concatenations
+    """
+    parts = list()
+    while pos < len(body):
+        opener = body[pos]
+        if opener in "{\"":
+            depth, end = 0, None
+            for delimiter in BIB_DELIMITER.finditer(body, pos + 1):
+                char = delimiter.group()
+                if char == "{":
+                    depth += 1
+                elif char == "}":
+                    if depth == 0 and opener == "{":
+                        end = delimiter.start()
+                        break
+                    depth -= 1
+                elif char == '"' and depth == 0 and opener == '"':
+                    end = delimiter.start()
+                    break
+            end = len(body) if end is None else end
+            parts.append(body[pos + 1:end])
+            pos = end + 1
+        else:
+            bare = BIB_BARE.match(body, pos)
+            parts.append(bare.group().strip())
+            pos = bare.end()
+        while pos < len(body) and body[pos] in " \t\r\n":
+            pos += 1
+        if pos < len(body) and body[pos] == "#":
+            pos += 1
+            while pos < len(body) and body[pos] in " \t\r\n":
+                pos += 1
+            continue
+        break
+    return "".join(parts), pos
+
+
+def as_query(title, list_dict):
+    """
+    (title, keys, total, items) for a dict of lists, items yielding (key, query)
+    """
+    total = sum(len(query_list) for query_list in list_dict.values())
+    items = ((key, query) for key, query_list in list_dict.items() for query in query_list)
+    return title, list(list_dict), total, items
+
+class Scheduler:
+    """
+    run the items of one or more Processing jobs on a single pool of workers,
+    taking an item from each job in turn so that no job waits on another
+    """
+    def __init__(self, jobs=config.__jobs__):
+        self.jobs = jobs
+
+    def run(self, tasks, label):
+        """
+        tasks are (processing, label, query_list, length, sub_dirs) as returned
+        by Processing.prepare; returns the undone queries of each task by sub_dir
+        """
+        undone = [{sub_dir: list() for sub_dir in task[4]} for task in tasks]
+        streams = deque((n, enumerate(task[2])) for n, task in enumerate(tasks))
+        pending = dict()
+        errors = dict()
+
+        def settle(futures):
+            for future in futures:
+                n, index, sub_dir, query = pending.pop(future)
+                try:
+                    item_done = future.result()
+                except Exception as error:
+                    # one bad item must not take down the other items and jobs
+                    typer.secho(f"\n{query}: {error!r}", fg=typer.colors.MAGENTA, err=True)
+                    item_done = False
+                if not item_done:
+                    undone[n][sub_dir].append((index, query))
+                progress.current_item = (index, query)
+                progress.update(1)
+
+        # at most 2 * jobs items are queued at a time, so the query lists are
+        # consumed (and paged) lazily, and the bar reports each item by its index.
+        with typer.progressbar(length=sum(task[3] for task in tasks), label=label, show_eta=False,
+                               show_percent=False, fill_char="▒",
+                               item_show_func=lambda x: f"{x[0]} | {x[1]}" if x else x) as progress:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                while streams:
+                    n, stream = streams.popleft()
+                    try:
+                        index, (sub_dir, query) = next(stream)
+                    except StopIteration:
+                        continue
+                    except Exception as error:
+                        # a job whose listing fails is dropped, the others go on
+                        typer.secho(f"\n{tasks[n][1]}: listing stopped: {error!r}", fg=typer.colors.MAGENTA, err=True)
+                        errors[n] = error
+                        continue
+                    streams.append((n, stream))
+                    pending[executor.submit(tasks[n][0].process, query, sub_dir)] = (n, index, sub_dir, query)
+                    if len(pending) >= 2 * self.jobs:
+                        settle(wait(pending, return_when=FIRST_COMPLETED).done)
+                settle(wait(pending).done)
+        for n, task in enumerate(tasks):
+            for sub_dir in undone[n]:
+                undone[n][sub_dir] = [query for index, query in sorted(undone[n][sub_dir])]
+            task[0].write_logs(undone[n], errors.get(n))
+        return undone
+
+
 class Processing:
-    def __init__(self, scihub, requester, query, save_to):
+    def __init__(self, scihub, requester, query, save_to, jobs=config.__jobs__, manifest=None,
+                 missing_ttl=config.__missing_ttl__, profile=False, root=None, store=None):
         self.scihub = scihub
         self.requester = requester
         self.query = query
         self.save_to = save_to
+        self.root = root or save_to
+        self.store = store
+        self.jobs = jobs
+        self.manifest = manifest
+        self.missing_ttl = missing_ttl * 3600
+        self.lock = threading.Lock()
+        self.file_locks = dict()
+        self.profile = profile
+        self.profiles = list()
+        self.local = threading.local()
+        # keys (years of a journal) with items that failed or were invalid
+        self.keys = dict()
+        self.unsettled = set()
         
     def download(self):
-        title, list_dict = self.query
-        for key,query_list in list_dict.items():
+        return self.walk_the_list(*self.prepare())
+
+    def prepare(self):
+        """
+        create the directories of the query, and return (label, query_list,
+        length, sub_dirs) with query_list yielding (sub_dir, query)
+        """
+        title, keys, total, items = self.query
+        sub_dirs = dict()
+        for key in keys:
             if title == key:
-                label = f"{title}: {len(query_list)}"
-                sub_dir = self.save_to
+                sub_dirs[key] = self.save_to
             else:
-                label = f"{title} ({key}): {len(query_list)}"
-                sub_dir = path.join(self.save_to, str(key))
-                if not path.exists(sub_dir): mkdir(sub_dir)
-            self.walk_the_list(label, query_list, sub_dir)
+                sub_dirs[key] = path.normpath(path.join(self.save_to, str(key)))
+                if not path.exists(sub_dirs[key]): mkdir(sub_dirs[key])
+        self.keys = {sub_dir: key for key, sub_dir in sub_dirs.items()}
+        query_list = ((sub_dirs[key], query) for key, query in items)
+        return f"{title}: {total}", query_list, total, list(sub_dirs.values())
         
-    def walk_the_list(self, label, query_list, sub_dir):
-   #     print(version_callback(False))
-        undone = list()
-        with typer.progressbar(query_list, label=label, show_eta=False, show_percent=False, fill_char="▒", 
-                               item_show_func=lambda x: f"{str(query_list.index(x))} | {x}" if x else x) as progress:
-            for query in progress:
-                item_done = self.get_pdf_scihub(query, sub_dir)
-                if not item_done:
-                    undone.append(query)
-        log = path.join(sub_dir, "missing.log")
-        with open(log, 'w') as f:
-            if undone:
-                f.writelines([f"{i}\n" for i in undone])
-                typer.secho(f'missing log: {log}', fg=typer.colors.MAGENTA, bold=True, italic=True)
-            else:
-                f.write("all done.")
-                typer.secho("all done.", fg=typer.colors.GREEN, bold=True, italic=True)
-        return undone
+    def walk_the_list(self, label, query_list, length, sub_dirs):
+        return Scheduler(self.jobs).run([(self, label, query_list, length, sub_dirs)], label)[0]
+
+    def write_logs(self, undone, error=None):
+        """
+        a missing.log per directory; when listing the query failed part way,
+        a directory without missing items is not reported as all done
+        """
+        for sub_dir, query_list in undone.items():
+            log = path.join(sub_dir, "missing.log")
+            with open(log, 'w') as f:
+                if query_list:
+                    f.writelines([f"{i}\n" for i in query_list])
+                    typer.secho(f'missing log: {log}', fg=typer.colors.MAGENTA, bold=True, italic=True)
+                elif error:
+                    f.write(f"listing incomplete: {error!r}")
+                    typer.secho(f'listing incomplete: {log}', fg=typer.colors.MAGENTA, bold=True, italic=True)
+                else:
+                    f.write("all done.")
+                    typer.secho("all done.", fg=typer.colors.GREEN, bold=True, italic=True)
     
+    def process(self, query, sub_dir):
+        """
+        get_pdf_scihub, timed, and profiled in each worker thread when asked to;
+        from Python 3.12 cProfile is process-wide, so the profiler enabled by
+        the caller covers the workers and another one cannot be started
+        """
+        started = time.perf_counter()
+        outcome = "failed"
+        try:
+            if self.profile and sys.version_info < (3, 12):
+                if not hasattr(self.local, "profile"):
+                    self.local.profile = cProfile.Profile()
+                    with self.lock:
+                        self.profiles.append(self.local.profile)
+                item_done = self.local.profile.runcall(self.get_pdf_scihub, query, sub_dir)
+            else:
+                item_done = self.get_pdf_scihub(query, sub_dir)
+            outcome = "done" if item_done else "missing"
+            return item_done
+        finally:
+            self.requester.metrics.record("item", "item", query=query, outcome=outcome,
+                                          seconds=round(time.perf_counter() - started, 4))
+
     def get_pdf_scihub(self, query, sub_dir):
-        response = self.requester.request(self.scihub, params={"request": query}, method="POST")
-        response_text = response.read().decode()
+        entry = self.manifest.get(query) if self.manifest else None
+        done_path = path.join(sub_dir, entry["file_name"]) if entry and entry["status"] == "done" else None
+        if done_path and path.exists(done_path) and is_pdf(done_path):
+            return True
+        if entry and entry["status"] == "missing" and time.time() - entry["updated"] < self.missing_ttl:
+            return False
+        try:
+            stored = self.store.lookup(query) if self.store else None
+            if stored:
+                # in the store already, reached through any identifier or directory
+                file_url, file_name = entry["file_url"] if entry else None, stored["name"]
+            elif entry and entry["status"] == "done":
+                # downloaded before, but into another directory or since deleted
+                file_url, file_name = entry["file_url"], entry["file_name"]
+            else:
+                file_url, file_name = self.resolve(query)
+            if not file_name:
+                self.record(query, sub_dir, "missing")
+                return False
+            if self.store and not stored:
+                stored = self.store.lookup(file_url)
+            digest = stored["sha256"] if stored else None
+            file_path = path.join(sub_dir, file_name)
+            with self.file_lock(file_path):
+                if path.exists(file_path) and not is_pdf(file_path):
+                    # an error page saved under a .pdf name by an earlier version
+                    remove(file_path)
+                if not path.exists(file_path):
+                    if stored:
+                        self.store.link(digest, file_path)
+                    else:
+                        digest = self.fetch(file_url, file_path)
+                        if not digest:
+                            self.record(query, sub_dir, "invalid", file_url, file_name)
+                            return False
+            if self.store and digest:
+                self.store.remember(digest, query, file_url)
+            self.record(query, sub_dir, "done", file_url, file_name, path.getsize(file_path))
+            return True
+        except Exception as error:
+            self.record(query, sub_dir, "failed")
+            raise error
+
+    def resolve(self, query):
+        with self.requester.request(self.scihub, params={"request": query}, method="POST", phase="resolve") as response:
+            response_text = response.read().decode()
         if "Sorry, sci-hub has not included this article yet" in response_text:
             file_url, file_name = False, False
         else:
@@ -185,14 +952,143 @@ class Processing:
                 file_name = re.search("/pdf/(.+)\?", file_url).group(1).replace("/", "@")
             else:
                 file_name = file_url.split("/")[-1].replace("?download=true", "")
-        if file_name:
-            file_path = path.join(sub_dir, file_name)
-            if path.exists(file_path):
-                return True
+        return file_url, file_name
+
+    def record(self, query, sub_dir, status, file_url=None, file_name=None, size=None):
+        if status in ("failed", "invalid"):
+            with self.lock:
+                self.unsettled.add(self.keys.get(sub_dir))
+        if self.manifest:
+            self.manifest.record(query, path.relpath(sub_dir, self.root), status, file_url, file_name, size)
+
+    @contextmanager
+    def file_lock(self, file_path):
+        # workers resolving to the same file take turns on it
+        with self.lock:
+            if file_path not in self.file_locks:
+                self.file_locks[file_path] = threading.Lock()
+            lock = self.file_locks[file_path]
+        with lock:
+            yield
+
+    def fetch(self, file_url, file_path):
+        """
+        stream file_url in chunks into a .part file, resuming a partial one with
+        a Range request when the server supports it, and hashing it on the way;
+        a file that is not a PDF is dropped, otherwise it is renamed into place
+        (or added to the store and linked). Returns its sha256, or None.
+        """
+        part_path = file_path + ".part"
+        for count in range(config.__retries__):
+            offset = path.getsize(part_path) if path.exists(part_path) else 0
+            try:
+                response = self.requester.request(file_url, headers={"range": f"bytes={offset}-"} if offset else None,
+                                                  phase="download")
+            except HTTPError as error:
+                if error.status == 416 and offset:
+                    remove(part_path)
+                    continue
+                raise error
+            with response:
+                if response.status == 206:
+                    content_range = re.match("bytes ([0-9]+)-", response.headers.get("content-range", ""))
+                    if not content_range or int(content_range.group(1)) != offset:
+                        remove(part_path)
+                        continue
+                sha256 = hashlib.sha256()
+                if response.status == 206:
+                    with open(part_path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(config.__chunk_size__), b""):
+                            sha256.update(chunk)
+                try:
+                    with open(part_path, 'ab' if response.status == 206 else 'wb') as f:
+                        for chunk in iter(lambda: response.read(config.__chunk_size__), b""):
+                            sha256.update(chunk)
+                            f.write(chunk)
+                except (HTTPException, ConnectionError, socket.timeout) as error:
+                    if count == config.__retries__ - 1:
+                        raise error
+                    continue
+            if not is_pdf(part_path):
+                remove(part_path)
+                return None
+            if self.store:
+                self.store.add(part_path, sha256.hexdigest(), path.basename(file_path))
+                self.store.link(sha256.hexdigest(), file_path)
             else:
-                response = self.requester.request(file_url)
-                with open(file_path, 'b+w') as f:
-                    f.write(response.read())
-                return True
-        else:
-            return False
\ No newline at end of file
+                replace(part_path, file_path)
+            return sha256.hexdigest()
+
+
+def is_pdf(file_path, min_size=config.__min_size__):
+    """
+    an error page saved under a .pdf name is not a PDF: the header must
+    appear within the first 1024 bytes, and the file must not be tiny
+    """
+    if path.getsize(file_path) < min_size:
+        return False
+    with open(file_path, 'rb') as f:
+        return b"%PDF-" in f.read(1024)
+
+
+class Store:
+    """
+    content-addressed store of downloaded files, kept under objects/ab/<sha256>
+    and hardlinked into every directory that wants them; its index maps each
+    normalized DOI/URL/PMID and file URL to a checksum
+    """
+    def __init__(self, root):
+        makedirs(path.join(root, "objects"), exist_ok=True)
+        self.root = root
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path.join(root, "index.db"), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS objects (sha256 TEXT PRIMARY KEY, size INTEGER, name TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, sha256 TEXT)")
+        self.db.commit()
+
+    def object_path(self, digest):
+        return path.join(self.root, "objects", digest[:2], digest)
+
+    def lookup(self, query):
+        """
+        the object stored for a DOI/URL/PMID or a file URL, if it is still on disk
+        """
+        if not query:
+            return None
+        with self.lock:
+            row = self.db.execute("""SELECT objects.* FROM keys JOIN objects USING (sha256)
+                WHERE keys.key = ?""", (normalize(query),)).fetchone()
+        return row if row and path.exists(self.object_path(row["sha256"])) else None
+
+    def add(self, file_path, digest, name):
+        with self.lock:
+            if path.exists(self.object_path(digest)):
+                remove(file_path)
+            else:
+                makedirs(path.dirname(self.object_path(digest)), exist_ok=True)
+                move(file_path, self.object_path(digest))
+            self.db.execute("INSERT OR IGNORE INTO objects VALUES (?, ?, ?)",
+                            (digest, path.getsize(self.object_path(digest)), name))
+            self.db.commit()
+
+    def link(self, digest, file_path):
+        try:
+            hardlink(self.object_path(digest), file_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # another file system, or one without hardlinks
+            copyfile(self.object_path(digest), file_path)
+
+    def remember(self, digest, *queries):
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO keys VALUES (?, ?)",
+                                [(normalize(query), digest) for query in queries if query])
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,47 @@
+from io import StringIO
+import pytest
+
+from sci_clone.util import iter_bibtex
+
+
+def parse(text, chunk_size=7):
+    return list(iter_bibtex(StringIO(text), chunk_size=chunk_size))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_nested_braces(chunk_size):
+    text = "@article{key,\n  title = {A {Nested {Deep}} Title},\n  doi = {10.1000/a}\n}\n"
+    assert parse(text, chunk_size) == [("article", {"title": "A Nested Deep Title", "doi": "10.1000/a"})]
+
+
+def test_at_sign_in_values():
+    text = ("@misc{key, note = {mail me@example.org}, url = \"http://x.org/@user\"}\n"
+            "@book{other, doi = {10.1000/b}}\n")
+    assert parse(text) == [("misc", {"note": "mail me@example.org", "url": "http://x.org/@user"}),
+                           ("book", {"doi": "10.1000/b"})]
+
+
+def test_concatenation():
+    text = "@article{key, doi = \"10.1000/\" # {c} # \"d\"}\n"
+    assert parse(text) == [("article", {"doi": "10.1000/cd"})]
+
+
+def test_comment_preamble_and_string_are_skipped():
+    text = ("@comment{ignore {this} }\n@string{jb = \"Journal\"}\n@preamble{\"x\"}\n"
+            "@ARTICLE(key, doi = {10.1000/e})\n")
+    assert parse(text) == [("article", {"doi": "10.1000/e"})]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_malformed_entry_is_skipped(chunk_size, capsys):
+    text = ("@article{broken, title={oops,\n  doi = {10.1000/x}\n}\n"
+            "@article{a, doi = {10.1000/a}}\n"
+            "@article{b, doi = {10.1000/b}}\n")
+    assert parse(text, chunk_size) == [("article", {"doi": "10.1000/a"}), ("article", {"doi": "10.1000/b"})]
+    assert "skipping malformed BibTeX entry: @article{broken" in capsys.readouterr().err
+
+
+def test_unterminated_last_entry(capsys):
+    text = "@article{a, doi = {10.1000/a}}\n@article{b, doi = {10.1000/b}\n"
+    assert parse(text) == [("article", {"doi": "10.1000/a"})]
+    assert "@article{b" in capsys.readouterr().err
@@ -0,0 +1,31 @@
+from os import path
+import sys
+
+from sci_clone import util, config
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "benchmarks"))
+from servers import SciHubStandIn
+
+
+class FlakySciHub(SciHubStandIn):
+    """
+    answers the first request with a 503, then behaves
+    """
+    def fail(self):
+        with self.lock:
+            self.requests += 1
+            return self.requests == 1
+
+
+def test_retry_after_503(monkeypatch):
+    monkeypatch.setattr(util.random, "uniform", lambda low, high: 0)
+    scihub = FlakySciHub(payload_size=1024).start()
+    try:
+        requester = util.Requester(config)
+        with requester.request(f"{scihub.url}/downloads/a.pdf") as response:
+            assert response.status == 200
+            assert response.read().startswith(b"%PDF")
+    finally:
+        scihub.stop()
+    assert scihub.requests == 2
+    assert requester.metrics.phases["http"]["retries"] == 1